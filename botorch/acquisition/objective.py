@@ -170,14 +170,12 @@ class MCAcquisitionObjective(Module, ABC):
         self, samples: Tensor, X: Optional[Tensor] = None, *args, **kwargs
     ) -> Tensor:
         output = super().__call__(samples=samples, X=X, *args, **kwargs)
+        if X is None or not self._verify_output_shape:
+            return output
         # q-batch dimension is at -1 for single-output objectives and at
         # -2 for multi-output objectives.
         q_batch_idx = -2 if self._is_mo else -1
-        if (
-            X is not None
-            and self._verify_output_shape
-            and output.shape[q_batch_idx] != X.shape[-2]
-        ):
+        if output.shape[q_batch_idx] != X.shape[-2]:
             raise RuntimeError(
                 "The q-batch shape of the objective values does not agree with "
                 f"the q-batch shape of X. Got {output.shape[q_batch_idx]} and "
@@ -5,7 +5,11 @@
 # LICENSE file in the root directory of this source tree.
 
 import itertools
+import random
 import warnings
+import zlib
+from functools import lru_cache
+from typing import Callable, List, Optional, Tuple
 
 import torch
 from botorch import settings
@@ -18,29 +22,63 @@ from botorch.acquisition.objective import (
     PosteriorTransform,
     ScalarizedPosteriorTransform,
 )
+from botorch.posteriors import GPyTorchPosterior
 from botorch.utils import apply_constraints
 from botorch.utils.testing import _get_test_posterior, BotorchTestCase
+from gpytorch.distributions import MultitaskMultivariateNormal
 from torch import Tensor
 
 
 def generic_obj_deprecated(samples: Tensor) -> Tensor:
-    return torch.log(torch.sum(samples ** 2, dim=-1))
+    return torch.einsum("...i,...i->...", samples, samples).log_()
 
 
-def generic_obj(samples: Tensor, X=None) -> Tensor:
+def generic_obj(samples: Tensor, X: Optional[Tensor] = None) -> Tensor:
     return generic_obj_deprecated(samples)
 
 
+@lru_cache(maxsize=None)
+def _randn(shape: Tuple[int, ...], dtype: torch.dtype, device: torch.device) -> Tensor:
+    # Deterministic standard normal samples, shared across all tests in this
+    # module. Callers only read from the returned tensors and must not modify
+    # them in place or register them on a module. The seed is the CRC32 of the
+    # shape and the dtype name, so that different keys draw different streams.
+    seed = zlib.crc32(f"{shape}-{dtype}".encode())
+    generator = torch.Generator(device=device)
+    generator.manual_seed(seed)
+    return torch.randn(shape, dtype=dtype, device=device, generator=generator)
+
+
+@lru_cache(maxsize=None)
+def _constant_con(value: float, dtype: torch.dtype, device: torch.device) -> Tensor:
+    return torch.full((), value, device=device, dtype=dtype)
+
+
+# The constraint values are returned as broadcast views of a cached scalar, so
+# they do not allocate any memory proportional to the sample shape.
 def infeasible_con(samples: Tensor) -> Tensor:
-    return torch.ones(samples.shape[0:-1], device=samples.device, dtype=samples.dtype)
+    return _constant_con(1.0, samples.dtype, samples.device).expand(samples.shape[0:-1])
 
 
 def feasible_con(samples: Tensor) -> Tensor:
-    return -(
-        torch.ones(samples.shape[0:-1], device=samples.device, dtype=samples.dtype)
+    return _constant_con(-1.0, samples.dtype, samples.device).expand(
+        samples.shape[0:-1]
     )
 
 
+def _slice_posterior(
+    posterior: GPyTorchPosterior, m: int, batched: bool = True
+) -> GPyTorchPosterior:
+    # Restrict a `q=1` posterior to its first `m` outputs (and to its first batch
+    # if `batched=False`) without re-sampling the MVN parameters. With `q=1` the
+    # leading `m x m` block of the covariance matrix belongs to the first `m`
+    # outputs.
+    batch_idx = ... if batched else 0
+    mean = posterior.mvn.mean[batch_idx][..., :m]
+    covar = posterior.mvn.covariance_matrix[batch_idx][..., :m, :m]
+    return GPyTorchPosterior(MultitaskMultivariateNormal(mean, covar))
+
+
 class TestPosteriorTransform(BotorchTestCase):
     def test_abstract_raises(self):
         with self.assertRaises(TypeError):
@@ -49,34 +87,44 @@ class TestPosteriorTransform(BotorchTestCase):
 
 class TestScalarizedPosteriorTransform(BotorchTestCase):
     def test_scalarized_posterior_transform(self):
-        for batch_shape, m, dtype in itertools.product(
-            ([], [3]), (1, 2), (torch.float, torch.double)
-        ):
-            offset = torch.rand(1).item()
-            weights = torch.randn(m, device=self.device, dtype=dtype)
-            obj = ScalarizedPosteriorTransform(weights=weights, offset=offset)
-            posterior = _get_test_posterior(
-                batch_shape, m=m, device=self.device, dtype=dtype
-            )
-            mean, covar = posterior.mvn.mean, posterior.mvn.covariance_matrix
-            new_posterior = obj(posterior)
-            exp_size = torch.Size(batch_shape + [1, 1])
-            self.assertEqual(new_posterior.mean.shape, exp_size)
-            new_mean_exp = offset + mean @ weights
-            self.assertTrue(torch.allclose(new_posterior.mean[..., -1], new_mean_exp))
-            self.assertEqual(new_posterior.variance.shape, exp_size)
-            new_covar_exp = ((covar @ weights) @ weights).unsqueeze(-1)
-            self.assertTrue(
-                torch.allclose(new_posterior.variance[..., -1], new_covar_exp)
+        for dtype in (torch.float, torch.double):
+            # construct a single batched, two-output posterior and slice out the
+            # non-batched and single-output variants from it
+            full_posterior = _get_test_posterior(
+                [3], m=2, device=self.device, dtype=dtype
             )
-            # test error
-            with self.assertRaises(ValueError):
-                ScalarizedPosteriorTransform(weights=torch.rand(2, m))
-            # test evaluate
-            Y = torch.rand(2, m, device=self.device, dtype=dtype)
-            val = obj.evaluate(Y)
-            val_expected = offset + Y @ weights
-            self.assertTrue(torch.equal(val, val_expected))
+            full_weights = torch.randn(2, device=self.device, dtype=dtype)
+            for batch_shape, m in itertools.product(([], [3]), (1, 2)):
+                with self.subTest(batch_shape=batch_shape, m=m, dtype=dtype):
+                    offset = random.random()
+                    weights = full_weights[:m]
+                    obj = ScalarizedPosteriorTransform(weights=weights, offset=offset)
+                    posterior = _slice_posterior(
+                        full_posterior, m=m, batched=len(batch_shape) > 0
+                    )
+                    mean, covar = posterior.mvn.mean, posterior.mvn.covariance_matrix
+                    new_posterior = obj(posterior)
+                    exp_size = torch.Size(batch_shape + [1, 1])
+                    self.assertEqual(new_posterior.mean.shape, exp_size)
+                    new_mean_exp = offset + mean @ weights
+                    torch.testing.assert_close(
+                        new_posterior.mean[..., -1], new_mean_exp
+                    )
+                    self.assertEqual(new_posterior.variance.shape, exp_size)
+                    new_covar_exp = torch.einsum(
+                        "...ij,i,j->...", covar, weights, weights
+                    ).unsqueeze(-1)
+                    torch.testing.assert_close(
+                        new_posterior.variance[..., -1], new_covar_exp
+                    )
+                    # test error
+                    with self.assertRaises(ValueError):
+                        ScalarizedPosteriorTransform(weights=torch.rand(2, m))
+                    # test evaluate
+                    Y = torch.rand(2, m, device=self.device, dtype=dtype)
+                    val = obj.evaluate(Y)
+                    val_expected = offset + Y @ weights
+                    self.assertTrue(torch.equal(val, val_expected))
 
 
 class TestMCAcquisitionObjective(BotorchTestCase):
@@ -100,157 +148,162 @@ class TestMCAcquisitionObjective(BotorchTestCase):
 
 
 class TestGenericMCObjective(BotorchTestCase):
+    def _check_generic_mc_objective(
+        self, obj: GenericMCObjective, dtype: torch.dtype
+    ) -> None:
+        pool = _randn((4, 3, 2), dtype, self.device)
+        samples_list = [pool[0, 0, :1], pool[0, 0], pool[0, :, :1], pool[0]]
+        # evaluate all objectives before comparing against the reference
+        values = [obj(samples) for samples in samples_list]
+        expected = [generic_obj(samples) for samples in samples_list]
+        for samples, val, val_expected in zip(samples_list, values, expected):
+            self.assertEqual(
+                val.shape, val_expected.shape, f"samples shape {samples.shape}"
+            )
+        # compare all values at once to only sync with the host a single time
+        self.assertTrue(
+            torch.equal(
+                torch.cat([val.flatten() for val in values]),
+                torch.cat([val.flatten() for val in expected]),
+            )
+        )
+
     def test_generic_mc_objective(self):
+        obj = GenericMCObjective(generic_obj)
         for dtype in (torch.float, torch.double):
-            obj = GenericMCObjective(generic_obj)
-            samples = torch.randn(1, device=self.device, dtype=dtype)
-            self.assertTrue(torch.equal(obj(samples), generic_obj(samples)))
-            samples = torch.randn(2, device=self.device, dtype=dtype)
-            self.assertTrue(torch.equal(obj(samples), generic_obj(samples)))
-            samples = torch.randn(3, 1, device=self.device, dtype=dtype)
-            self.assertTrue(torch.equal(obj(samples), generic_obj(samples)))
-            samples = torch.randn(3, 2, device=self.device, dtype=dtype)
-            self.assertTrue(torch.equal(obj(samples), generic_obj(samples)))
+            with self.subTest(dtype=dtype):
+                self._check_generic_mc_objective(obj=obj, dtype=dtype)
 
     def test_generic_mc_objective_deprecated(self):
+        with warnings.catch_warnings(record=True) as ws, settings.debug(True):
+            obj = GenericMCObjective(generic_obj_deprecated)
+            warning_msg = (
+                "The `objective` callable of `GenericMCObjective` is expected to "
+                "take two arguments. Passing a callable that expects a single "
+                "argument will result in an error in future versions."
+            )
+            self.assertTrue(any(issubclass(w.category, DeprecationWarning) for w in ws))
+            self.assertTrue(any(warning_msg in str(w.message) for w in ws))
         for dtype in (torch.float, torch.double):
-            with warnings.catch_warnings(record=True) as ws, settings.debug(True):
-                obj = GenericMCObjective(generic_obj_deprecated)
-                warning_msg = (
-                    "The `objective` callable of `GenericMCObjective` is expected to "
-                    "take two arguments. Passing a callable that expects a single "
-                    "argument will result in an error in future versions."
-                )
-                self.assertTrue(
-                    any(issubclass(w.category, DeprecationWarning) for w in ws)
-                )
-                self.assertTrue(any(warning_msg in str(w.message) for w in ws))
-            samples = torch.randn(1, device=self.device, dtype=dtype)
-            self.assertTrue(torch.equal(obj(samples), generic_obj(samples)))
-            samples = torch.randn(2, device=self.device, dtype=dtype)
-            self.assertTrue(torch.equal(obj(samples), generic_obj(samples)))
-            samples = torch.randn(3, 1, device=self.device, dtype=dtype)
-            self.assertTrue(torch.equal(obj(samples), generic_obj(samples)))
-            samples = torch.randn(3, 2, device=self.device, dtype=dtype)
-            self.assertTrue(torch.equal(obj(samples), generic_obj(samples)))
+            with self.subTest(dtype=dtype):
+                self._check_generic_mc_objective(obj=obj, dtype=dtype)
 
 
 class TestConstrainedMCObjective(BotorchTestCase):
+    def _check_constrained_mc_objective(
+        self,
+        obj: ConstrainedMCObjective,
+        samples: Tensor,
+        constraints: List[Callable[[Tensor], Tensor]],
+        infeasible_cost: float,
+    ) -> None:
+        constrained_obj = generic_obj(samples)
+        constrained_obj = apply_constraints(
+            obj=constrained_obj,
+            constraints=constraints,
+            samples=samples,
+            infeasible_cost=infeasible_cost,
+        )
+        self.assertTrue(torch.equal(obj(samples), constrained_obj))
+
     def test_constrained_mc_objective(self):
+        constraints = [feasible_con, infeasible_con]
+        obj_f = ConstrainedMCObjective(
+            objective=generic_obj, constraints=[feasible_con]
+        )
+        obj_i = ConstrainedMCObjective(
+            objective=generic_obj, constraints=[infeasible_con]
+        )
+        obj_fi_0 = ConstrainedMCObjective(
+            objective=generic_obj, constraints=constraints
+        )
+        obj_fi_5 = ConstrainedMCObjective(
+            objective=generic_obj, constraints=constraints, infeasible_cost=5.0
+        )
         for dtype in (torch.float, torch.double):
-            # one feasible constraint
-            obj = ConstrainedMCObjective(
-                objective=generic_obj, constraints=[feasible_con]
-            )
-            samples = torch.randn(1, device=self.device, dtype=dtype)
-            constrained_obj = generic_obj(samples)
-            constrained_obj = apply_constraints(
-                obj=constrained_obj,
-                constraints=[feasible_con],
-                samples=samples,
-                infeasible_cost=0.0,
-            )
-            self.assertTrue(torch.equal(obj(samples), constrained_obj))
-            # one infeasible constraint
-            obj = ConstrainedMCObjective(
-                objective=generic_obj, constraints=[infeasible_con]
-            )
-            samples = torch.randn(2, device=self.device, dtype=dtype)
-            constrained_obj = generic_obj(samples)
-            constrained_obj = apply_constraints(
-                obj=constrained_obj,
-                constraints=[infeasible_con],
-                samples=samples,
-                infeasible_cost=0.0,
-            )
-            self.assertTrue(torch.equal(obj(samples), constrained_obj))
-            # one feasible, one infeasible
-            obj = ConstrainedMCObjective(
-                objective=generic_obj, constraints=[feasible_con, infeasible_con]
-            )
-            samples = torch.randn(2, 1, device=self.device, dtype=dtype)
-            constrained_obj = generic_obj(samples)
-            constrained_obj = apply_constraints(
-                obj=constrained_obj,
-                constraints=[feasible_con, infeasible_con],
-                samples=samples,
-                infeasible_cost=0.0,
-            )
-            self.assertTrue(torch.equal(obj(samples), constrained_obj))
-            # one feasible, one infeasible, infeasible_cost
-            obj = ConstrainedMCObjective(
-                objective=generic_obj,
-                constraints=[feasible_con, infeasible_con],
-                infeasible_cost=5.0,
-            )
-            samples = torch.randn(3, 2, device=self.device, dtype=dtype)
-            constrained_obj = generic_obj(samples)
-            constrained_obj = apply_constraints(
-                obj=constrained_obj,
-                constraints=[feasible_con, infeasible_con],
-                samples=samples,
-                infeasible_cost=5.0,
-            )
-            self.assertTrue(torch.equal(obj(samples), constrained_obj))
-            # one feasible, one infeasible, infeasible_cost, higher dimension
-            obj = ConstrainedMCObjective(
-                objective=generic_obj,
-                constraints=[feasible_con, infeasible_con],
-                infeasible_cost=5.0,
-            )
-            samples = torch.randn(4, 3, 2, device=self.device, dtype=dtype)
-            constrained_obj = generic_obj(samples)
-            constrained_obj = apply_constraints(
-                obj=constrained_obj,
-                constraints=[feasible_con, infeasible_con],
-                samples=samples,
-                infeasible_cost=5.0,
-            )
-            self.assertTrue(torch.equal(obj(samples), constrained_obj))
+            with self.subTest(dtype=dtype):
+                pool = _randn((4, 3, 2), dtype, self.device)
+                # one feasible constraint
+                self._check_constrained_mc_objective(
+                    obj=obj_f,
+                    samples=pool[0, 0, :1],
+                    constraints=[feasible_con],
+                    infeasible_cost=0.0,
+                )
+                # one infeasible constraint
+                self._check_constrained_mc_objective(
+                    obj=obj_i,
+                    samples=pool[0, 0],
+                    constraints=[infeasible_con],
+                    infeasible_cost=0.0,
+                )
+                # one feasible, one infeasible, with and without infeasible_cost,
+                # for increasing dimensions
+                for samples in (pool[0, :2, :1], pool[0], pool):
+                    self._check_constrained_mc_objective(
+                        obj=obj_fi_0,
+                        samples=samples,
+                        constraints=constraints,
+                        infeasible_cost=0.0,
+                    )
+                    self._check_constrained_mc_objective(
+                        obj=obj_fi_5,
+                        samples=samples,
+                        constraints=constraints,
+                        infeasible_cost=5.0,
+                    )
 
 
 class TestIdentityMCObjective(BotorchTestCase):
+    def _check_identity_mc_objective(self, dtype: torch.dtype) -> None:
+        obj = IdentityMCObjective()
+        cases = []
+        # single-element tensor is squeezed to a scalar
+        samples = _randn((1,), dtype, self.device)
+        cases.append((samples, samples[0]))
+        # single-dimensional non-squeezable tensor is returned as is
+        samples = _randn((2,), dtype, self.device)
+        cases.append((samples, samples))
+        # two-dimensional squeezable tensor has its last dimension squeezed
+        samples = _randn((3, 1), dtype, self.device)
+        cases.append((samples, samples.squeeze(-1)))
+        # two-dimensional non-squeezable tensor is returned as is
+        samples = _randn((3, 2), dtype, self.device)
+        cases.append((samples, samples))
+        # evaluate all objectives before comparing against the expected values
+        values = [obj(samples) for samples, _ in cases]
+        for val, (_, expected) in zip(values, cases):
+            self.assertTrue(torch.equal(val, expected))
+
     def test_identity_mc_objective(self):
         for dtype in (torch.float, torch.double):
-            obj = IdentityMCObjective()
-            # single-element tensor
-            samples = torch.randn(1, device=self.device, dtype=dtype)
-            self.assertTrue(torch.equal(obj(samples), samples[0]))
-            # single-dimensional non-squeezable tensor
-            samples = torch.randn(2, device=self.device, dtype=dtype)
-            self.assertTrue(torch.equal(obj(samples), samples))
-            # two-dimensional squeezable tensor
-            samples = torch.randn(3, 1, device=self.device, dtype=dtype)
-            self.assertTrue(torch.equal(obj(samples), samples.squeeze(-1)))
-            # two-dimensional non-squeezable tensor
-            samples = torch.randn(3, 2, device=self.device, dtype=dtype)
-            self.assertTrue(torch.equal(obj(samples), samples))
+            with self.subTest(dtype=dtype):
+                self._check_identity_mc_objective(dtype=dtype)
 
 
 class TestLinearMCObjective(BotorchTestCase):
     def test_linear_mc_objective(self):
         for dtype in (torch.float, torch.double):
-            weights = torch.rand(3, device=self.device, dtype=dtype)
-            obj = LinearMCObjective(weights=weights)
-            samples = torch.randn(4, 2, 3, device=self.device, dtype=dtype)
-            self.assertTrue(
-                torch.allclose(obj(samples), (samples * weights).sum(dim=-1))
-            )
-            samples = torch.randn(5, 4, 2, 3, device=self.device, dtype=dtype)
-            self.assertTrue(
-                torch.allclose(obj(samples), (samples * weights).sum(dim=-1))
-            )
-            # make sure this errors if sample output dimensions are incompatible
-            with self.assertRaises(RuntimeError):
-                obj(samples=torch.randn(2, device=self.device, dtype=dtype))
-            with self.assertRaises(RuntimeError):
-                obj(samples=torch.randn(1, device=self.device, dtype=dtype))
-            # make sure we can't construct objectives with multi-dim. weights
-            with self.assertRaises(ValueError):
-                LinearMCObjective(
-                    weights=torch.rand(2, 3, device=self.device, dtype=dtype)
-                )
-            with self.assertRaises(ValueError):
-                LinearMCObjective(
-                    weights=torch.tensor(1.0, device=self.device, dtype=dtype)
-                )
+            with self.subTest(dtype=dtype):
+                weights = torch.rand(3, device=self.device, dtype=dtype)
+                obj = LinearMCObjective(weights=weights)
+                samples = _randn((4, 2, 3), dtype, self.device)
+                expected = torch.einsum("...i,i->...", samples, weights)
+                torch.testing.assert_close(obj(samples), expected)
+                samples = _randn((5, 4, 2, 3), dtype, self.device)
+                expected = torch.einsum("...i,i->...", samples, weights)
+                torch.testing.assert_close(obj(samples), expected)
+                # make sure this errors if sample output dimensions are incompatible
+                with self.assertRaises(RuntimeError):
+                    obj(samples=_randn((2,), dtype, self.device))
+                with self.assertRaises(RuntimeError):
+                    obj(samples=_randn((1,), dtype, self.device))
+                # make sure we can't construct objectives with multi-dim. weights
+                with self.assertRaises(ValueError):
+                    LinearMCObjective(
+                        weights=torch.rand(2, 3, device=self.device, dtype=dtype)
+                    )
+                with self.assertRaises(ValueError):
+                    LinearMCObjective(
+                        weights=torch.tensor(1.0, device=self.device, dtype=dtype)
+                    )